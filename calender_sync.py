@@ -5,27 +5,85 @@
 import os
 import sys
 import datetime
+import hashlib
+import random
+import time
+import sqlite3
+import threading
+from typing import Any, Iterator
 import requests
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+import ijson
+import orjson
+from urllib.parse import urlparse, parse_qs, urlencode
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+from concurrent.futures import ThreadPoolExecutor
+# Only the lightweight googleapiclient modules are imported up front; the auth
+# stack and discovery are imported where they are used to keep startup fast
+from googleapiclient.errors import BatchError, HttpError
+from googleapiclient.model import JsonModel
 
 # --- Configuration ---
 # 1. Canvas API Configuration
 CANVAS_API_URL = "https://canvas.instructure.com/" # e.g., "https://canvas.instructure.com/api/v1"
 CANVAS_API_TOKEN = os.environ.get('CANVAS_API_TOKEN')
+CANVAS_PER_PAGE = 100 # Largest page size Canvas allows
+CANVAS_MAX_WORKERS = 6 # Number of Canvas pages fetched at once
+CANVAS_FIELDS = ('id', 'title', 'due_at', 'end_at', 'html_url', 'context_name') # Fields kept from each item
 
 # 2. Google Calendar Configuration
 GOOGLE_CALENDAR_ID = "primary" 
 SCOPES = ['https://www.googleapis.com/auth/calendar']
+BATCH_SIZE = 50 # The Calendar API accepts at most 50 calls per batch request
+MAX_WORKERS = 8 # Number of batch requests in flight at once
+MAX_RETRIES = 5 # Times a call failing with a transient error is re-sent
+RETRY_STATUSES = (429, 500, 502, 503, 504) # Rate limits and transient server errors
+
+# 3. Local Sync State
+SYNC_DB = 'synced.db' # Remembers what was already synced so unchanged events are skipped
+
+ONE_HOUR = datetime.timedelta(hours=1) # Events start an hour before the due date
+
+# Each batch worker thread keeps its own AuthorizedHttp, since httplib2.Http is not thread-safe
+THREAD_LOCAL = threading.local()
+
+# Shared session so every Canvas request reuses kept-alive TCP+TLS connections
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=8,
+    pool_maxsize=16,
+    max_retries=Retry(
+        total=MAX_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=RETRY_STATUSES,
+        respect_retry_after_header=True,
+    ),
+))
 
 # --- Helper Functions ---
 
+class OrjsonModel(JsonModel):
+    """JsonModel that decodes Calendar response bodies with orjson.
+
+    Request bodies keep the stock json.dumps serialization: it escapes non-ASCII
+    text, which batch requests rely on for their part lengths and latin-1 bodies.
+    """
+
+    def deserialize(self, content):
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            # Non-JSON bodies (e.g. some error pages) get the stock handling
+            return super().deserialize(content)
+
 
 def get_google_creds():
     """Gets valid user credentials from storage or initiates OAuth2 flow."""
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from google.auth.transport.requests import Request
+
     creds = None
     if os.path.exists('token.json'):
         creds = Credentials.from_authorized_user_file('token.json', SCOPES)
@@ -42,60 +100,259 @@ def get_google_creds():
             token.write(creds.to_json())
     return creds
 
-def get_canvas_assignments(api_url, api_token):
-    """Fetches upcoming assignments from the Canvas API."""
+def get_canvas_page(url, headers, params=None):
+    """Fetches a single page from the Canvas API, raising on bad status codes.
+
+    The body is left unread so it can be streamed with iter_canvas_items.
+    """
+    response = SESSION.get(url, headers=headers, params=params, stream=True)
+    response.raise_for_status()
+    return response
+
+def iter_canvas_items(response: requests.Response) -> Iterator[dict[str, Any]]:
+    """Stream-parses a Canvas list response, yielding only the fields in CANVAS_FIELDS."""
+    response.raw.decode_content = True # Let urllib3 undo any gzip encoding
+    for item in ijson.items(response.raw, 'item'):
+        yield {field: item.get(field) for field in CANVAS_FIELDS}
+
+def get_canvas_page_urls(response):
+    """Builds the URLs of pages 2..last from a Canvas pagination Link header.
+
+    Returns None if the last page is not advertised as a page number.
+    """
+    last = response.links.get('last')
+    if not last:
+        return None
+    url = urlparse(last['url'])
+    query = parse_qs(url.query)
+    last_page = query.get('page', [''])[0]
+    if not last_page.isdigit():
+        return None
+    urls = []
+    for page in range(2, int(last_page) + 1):
+        query['page'] = [str(page)]
+        urls.append(url._replace(query=urlencode(query, doseq=True)).geturl())
+    return urls
+
+def get_canvas_assignments(api_url, api_token, etag=None):
+    """Fetches upcoming assignments from the Canvas API, following pagination.
+
+    Returns an (assignments, etag) pair. If etag still matches the first page,
+    Canvas answers 304 Not Modified and assignments is None. The returned etag
+    is None unless the whole result fits on one page.
+    """
     headers = {'Authorization': f'Bearer {api_token}'}
     # This endpoint gets upcoming assignments for the user
     assignments_url = f'{api_url}/api/v1/users/self/upcoming_events'
+    # Only the first page can be conditional, so an ETag is only ever saved for single-page results
+    first_page_headers = {**headers, 'If-None-Match': etag} if etag else headers
     try:
-        response = requests.get(assignments_url, headers=headers)
-        response.raise_for_status()  # Raises an exception for bad status codes
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        response = get_canvas_page(assignments_url, first_page_headers, params={'per_page': CANVAS_PER_PAGE})
+        if response.status_code == 304:
+            return None, etag
+        assignments = list(iter_canvas_items(response))
+        # A full first page could stay identical while later pages change, so only trust
+        # the ETag when there is no next page and room for new items on this one
+        single_page = 'next' not in response.links and len(assignments) < CANVAS_PER_PAGE
+        etag = response.headers.get('ETag') if single_page else None
+
+        page_urls = get_canvas_page_urls(response)
+        if page_urls is not None:
+            # Numbered pages are known up front, so fetch the rest concurrently
+            with ThreadPoolExecutor(max_workers=CANVAS_MAX_WORKERS) as executor:
+                pages = executor.map(lambda url: list(iter_canvas_items(get_canvas_page(url, headers))), page_urls)
+                for page in pages:
+                    assignments.extend(page)
+        else:
+            # Bookmark-style pages can only be walked one after another
+            next_link = response.links.get('next')
+            while next_link:
+                response = get_canvas_page(next_link['url'], headers)
+                assignments.extend(iter_canvas_items(response))
+                next_link = response.links.get('next')
+        return assignments, etag
+    # Streaming reads response.raw directly, so mid-body failures surface as urllib3 errors
+    except (requests.exceptions.RequestException, Urllib3HTTPError, ijson.JSONError) as e:
         print(f"Error fetching from Canvas API: {e}", file=sys.stderr)
-        return []
+        return [], None
 
-def create_google_calendar_event(service, assignment):
-    """Creates a Google Calendar event for a given Canvas assignment."""
-    due_at_str = assignment.get('end_at')
+def build_event_body(assignment: dict[str, Any]) -> tuple[str, dict[str, Any]] | None:
+    """Builds an (iCalUID, event body) pair for a Canvas assignment, or None if it has no due date."""
+    get = assignment.get
+    due_at_str = get('due_at') or get('end_at')
     if not due_at_str:
-        return # Skip assignments with no due date
+        return None # Skip assignments with no due date
+
+    # Use a stable iCalUID so importing the event again updates it instead of duplicating it
+    canvas_id = str(get('id')).replace('-', '').lower()
+    ical_uid = f"canvas{canvas_id}@canvas-calendar-sync"
+
+    # Canvas dates are in ISO 8601 format (UTC); fromisoformat accepts the 'Z' suffix on Python 3.11+
+    due_at = datetime.datetime.fromisoformat(due_at_str)
 
-    # Canvas dates are in ISO 8601 format (UTC)
-    due_at = datetime.datetime.fromisoformat(due_at_str.replace('Z', '+00:00'))
-    
     # Google Calendar API works well with RFC3339 format
-    start_time = (due_at - datetime.timedelta(hours=1)).isoformat()
-    end_time = due_at.isoformat()
-
-    # Use a unique ID to prevent duplicate events on subsequent runs
-    event_id = f"canvas{assignment.get('id')}".replace('-', '').lower()
-
-    event = {
-        'id': event_id,
-        'summary': assignment.get('title', 'Untitled Assignment'),
-        'description': f"Due: {assignment.get('title')}\nCourse: {assignment.get('context_name')}\nLink: {assignment.get('html_url')}",
-        'start': {
-            'dateTime': start_time,
-        },
-        'end': {
-            'dateTime': end_time,
-        },
+    title = get('title')
+    return ical_uid, {
+        'iCalUID': ical_uid,
+        'summary': title or 'Untitled Assignment',
+        'description': f"Due: {title}\nCourse: {get('context_name')}\nLink: {get('html_url')}",
+        'start': {'dateTime': (due_at - ONE_HOUR).isoformat()},
+        'end': {'dateTime': due_at.isoformat()},
     }
 
+def event_etag(body: dict[str, Any]) -> str:
+    """Hashes the fields of an event body that are sent to Google Calendar."""
+    key = f"{body['summary']}|{body['description']}|{body['start']['dateTime']}|{body['end']['dateTime']}"
+    return hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+
+def open_sync_db(path):
+    """Opens the local sync database, creating its tables on first use."""
+    db = sqlite3.connect(path)
+    db.execute('CREATE TABLE IF NOT EXISTS synced (id TEXT PRIMARY KEY, etag TEXT)')
+    db.execute('CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT)')
+    return db
+
+def get_sync_state(db, key):
+    """Reads a value saved by a previous run, or None if there is none."""
+    row = db.execute('SELECT value FROM sync_state WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else None
+
+def set_sync_state(db, key, value):
+    """Saves a value for the next run."""
+    with db:
+        db.execute('INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)', (key, value))
+
+def is_retryable(error):
+    """Checks whether an error is a transport failure, rate limit or transient server error."""
+    if error is None:
+        return False
+    if isinstance(error, BatchError) or not isinstance(error, HttpError):
+        # Malformed batch replies and connection errors (httplib2.HttpLib2Error, OSError) are transient
+        return True
+    return error.resp.status in RETRY_STATUSES
+
+def get_retry_after(error):
+    """Returns the delay in seconds requested by a Retry-After header, or 0."""
+    resp = getattr(error, 'resp', None)
+    if resp is None:
+        return 0
+    try:
+        return float(resp.get('retry-after', 0))
+    except ValueError:
+        return 0 # HTTP-date values are rare here; fall back to plain backoff
+
+def get_thread_http(creds):
+    """Returns the calling thread's AuthorizedHttp, creating it on first use."""
+    import httplib2
+    from google_auth_httplib2 import AuthorizedHttp
+
+    http = getattr(THREAD_LOCAL, 'http', None)
+    if http is None or http.credentials is not creds:
+        http = THREAD_LOCAL.http = AuthorizedHttp(creds, http=httplib2.Http())
+    return http
+
+def execute_batch(creds, batch):
+    """Executes a single batch request on the worker's HTTP connection, returning any error."""
+    import httplib2
+
     try:
-        # Use insert with the event ID. If it exists, it fails, so we update it.
-        service.events().insert(calendarId=CALENDAR_ID, body=event).execute()
-        print(f"Created event: {event['summary']}")
+        batch.execute(http=get_thread_http(creds))
     except HttpError as error:
-        if error.resp.status == 409: # 409 is the status code for "Conflict" (duplicate ID)
-            try:
-                service.events().update(calendarId=CALENDAR_ID, eventId=event_id, body=event).execute()
-                print(f"Updated event: {event['summary']}")
-            except HttpError as update_error:
-                print(f"Failed to update event '{event['summary']}': {update_error}", file=sys.stderr)
+        return error
+    except (httplib2.HttpLib2Error, OSError) as error:
+        # Drop the broken connection so the retry opens a fresh one
+        THREAD_LOCAL.http = None
+        return error
+    return None
+
+def execute_in_batches(service, creds, calls, callback):
+    """Executes (request_id, request) pairs as batch requests of up to BATCH_SIZE calls.
+
+    Calls that fail with a retryable status are re-sent in later batches with
+    exponential backoff and jitter, up to MAX_RETRIES times.
+    """
+    pending = dict(calls)
+    # One pool for every round so workers keep their connections across retries
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for attempt in range(MAX_RETRIES + 1):
+            last_attempt = attempt == MAX_RETRIES
+            retry_ids = []
+            retry_after = 0
+
+            def on_response(request_id, response, exception):
+                nonlocal retry_after
+                if not last_attempt and is_retryable(exception):
+                    retry_ids.append(request_id)
+                    retry_after = max(retry_after, get_retry_after(exception))
+                else:
+                    callback(request_id, response, exception)
+
+            chunks = [calls[i:i + BATCH_SIZE] for i in range(0, len(calls), BATCH_SIZE)]
+            batches = []
+            for chunk in chunks:
+                batch = service.new_batch_http_request(callback=on_response)
+                for request_id, request in chunk:
+                    batch.add(request, request_id=request_id)
+                batches.append(batch)
+
+            errors = list(executor.map(lambda batch: execute_batch(creds, batch), batches))
+
+            for chunk, error in zip(chunks, errors):
+                if error is None:
+                    continue
+                if not last_attempt and is_retryable(error):
+                    retry_ids.extend(request_id for request_id, _ in chunk)
+                    retry_after = max(retry_after, get_retry_after(error))
+                else:
+                    print(f"An error occurred executing a batch request: {error}", file=sys.stderr)
+
+            if not retry_ids:
+                return
+            # Exponential backoff with jitter, but never sooner than the server asked for
+            delay = max(retry_after, random.uniform(0, 0.5 * 2 ** attempt))
+            print(f"Retrying {len(retry_ids)} calls in {delay:.1f}s (Retry-After: {retry_after:g}s)...", file=sys.stderr)
+            time.sleep(delay)
+            calls = [(request_id, pending[request_id]) for request_id in retry_ids]
+
+def sync_events(service: Any, creds: Any, events: list[tuple[str, dict[str, Any]]], db: sqlite3.Connection) -> bool:
+    """Imports (iCalUID, body) pairs into Google Calendar in batches, skipping unchanged events.
+
+    Returns True if every changed event was imported successfully.
+    """
+    synced_etags = dict(db.execute('SELECT id, etag FROM synced'))
+    # Key by iCalUID; a batch rejects duplicate request IDs
+    bodies = {}
+    etags = {}
+    for ical_uid, body in events:
+        etag = event_etag(body)
+        if synced_etags.get(ical_uid) != etag:
+            bodies[ical_uid] = body
+            etags[ical_uid] = etag
+    print(f"{len(bodies)} events changed since the last sync.")
+    synced = []
+
+    def on_import(request_id, response, exception):
+        summary = bodies[request_id]['summary']
+        if exception is None:
+            print(f"Synced event: {summary}")
+            synced.append((request_id, etags[request_id]))
         else:
-            print(f"An error occurred creating event '{event['summary']}': {error}", file=sys.stderr)
+            print(f"An error occurred syncing event '{summary}': {exception}", file=sys.stderr)
+
+    # service.events() synthesizes a new Resource with all its methods on every call, so build it once
+    calendar_events = service.events()
+    # events.import upserts by iCalUID, so re-runs cost a single call per event
+    imports = [
+        (ical_uid, calendar_events.import_(calendarId=GOOGLE_CALENDAR_ID, body=body))
+        for ical_uid, body in bodies.items()
+    ]
+    try:
+        execute_in_batches(service, creds, imports, on_import)
+    finally:
+        # Record every successful import in a single transaction, even if the submission failed part-way
+        with db:
+            db.executemany('INSERT OR REPLACE INTO synced (id, etag) VALUES (?, ?)', synced)
+    return len(synced) == len(bodies)
 
 def main():
     """Main function to run the sync process."""
@@ -106,25 +363,44 @@ def main():
         print("export CANVAS_API_TOKEN='your_token_here'", file=sys.stderr)
         sys.exit(1)
 
-    creds = get_google_creds()
+    from googleapiclient.discovery import build
+
+    db = open_sync_db(SYNC_DB)
     try:
-        service = build('calendar', 'v3', credentials=creds)
-        print("Successfully connected to Google Calendar.")
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # Canvas doesn't depend on Google auth, so fetch it while we connect to Google Calendar
+            canvas_future = executor.submit(
+                get_canvas_assignments, CANVAS_API_URL, CANVAS_API_TOKEN, get_sync_state(db, 'canvas_etag'))
+
+            creds = get_google_creds()
+            # Load the discovery document bundled with googleapiclient instead of fetching it
+            service = build('calendar', 'v3', credentials=creds, static_discovery=True, cache_discovery=False,
+                            model=OrjsonModel())
+            print("Successfully connected to Google Calendar.")
 
-        assignments = get_canvas_assignments(CANVAS_API_URL, CANVAS_API_TOKEN)
+            assignments, canvas_etag = canvas_future.result()
+
+        if assignments is None:
+            print("Canvas assignments are unchanged since the last sync.")
+            return
         if not assignments:
             print("No upcoming assignments found or failed to fetch from Canvas.")
             return
 
         print(f"Found {len(assignments)} upcoming assignments. Syncing to Google Calendar...")
-        for assignment in assignments:
-            create_google_calendar_event(service, assignment)
+        # Build every event body up front so the submission phase is pure I/O
+        events = [event for event in map(build_event_body, assignments) if event is not None]
+        # Only trust the ETag once everything it covers has reached the calendar; a None clears it
+        if sync_events(service, creds, events, db):
+            set_sync_state(db, 'canvas_etag', canvas_etag)
         print("Sync complete.")
 
     except HttpError as error:
         print(f'An error occurred with the Google API: {error}', file=sys.stderr)
     except Exception as e:
         print(f'An unexpected error occurred: {e}', file=sys.stderr)
+    finally:
+        db.close()
 
 if __name__ == '__main__':
     main()
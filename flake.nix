@@ -13,6 +13,8 @@
       # Define our Python package set once
       pythonPackages = ps: [
         ps.requests
+        ps.ijson
+        ps.orjson
         ps.google-api-python-client
         ps.google-auth-httplib2
         ps.google-auth-oauthlib
@@ -0,0 +1,28 @@
+import pytest
+
+pytest.importorskip('googleapiclient')
+pytest.importorskip('ijson')
+pytest.importorskip('orjson')
+
+from googleapiclient.discovery import build
+
+import calender_sync
+
+
+def test_batch_serializes_non_ascii_event_as_ascii():
+    service = build('calendar', 'v3', developerKey='test', static_discovery=True,
+                    cache_discovery=False, model=calender_sync.OrjsonModel())
+    body = {
+        'iCalUID': 'canvasassignment_1@canvas-calendar-sync',
+        'summary': 'Week 3 – Students’ essays',
+        'start': {'dateTime': '2026-10-15T22:59:00+00:00'},
+        'end': {'dateTime': '2026-10-15T23:59:00+00:00'},
+    }
+    request = service.events().import_(calendarId='primary', body=body)
+    batch = service.new_batch_http_request()
+    batch.add(request, request_id='1')
+
+    # Batch parts are sized with len(str) and sent latin-1 encoded, so they must be pure ASCII
+    part = batch._serialize_request(request)
+    assert part.isascii()
+    part.encode('latin-1')